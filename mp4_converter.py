@@ -1,39 +1,184 @@
 import os
+import sys
 import subprocess
-import glob
 import re
+import json
+import functools
+import hashlib
+import shutil
+import time
+import asyncio
+import argparse
+from collections import deque, namedtuple
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# Full paths let subprocess start ffmpeg/ffprobe with posix_spawn instead of fork+exec
+# (needs close_fds=False too, which is used for the short-lived probe calls). Windows has
+# no posix_spawn, and not closing handles there leaks them into concurrent probes
+FFMPEG = shutil.which('ffmpeg') or 'ffmpeg'
+FFPROBE = shutil.which('ffprobe') or 'ffprobe'
+SPAWN_OPTIONS = {'close_fds': False} if os.name == 'posix' else {}
+
+BATCH_SIZE = 4  # Videos converted by one ffmpeg process (shares decoder/encoder setup)
+PROGRESS_INTERVAL = 0.5  # Minimum seconds between progress updates
+PROGRESS_TEMPLATE = "{} Progress: {:.1f}% - {:.1f} fps"
+ENCODER_CACHE_FILE = Path.home() / '.cache' / 'mp4_converter' / 'encoder.json'  # Detected encoder per machine
+
+# Video filters scaling to 1920x1080, with centered black bars (pad) or plain scaling for 16:9 videos
+SCALE_PAD_FILTER = "scale=1920:1080:force_original_aspect_ratio=decrease,pad=1920:1080:-1:-1:black"
+SCALE_FILTER = "scale=1920:1080"
+CUDA_SCALE_PAD_FILTER = "scale_cuda=1920:1080:force_original_aspect_ratio=decrease,pad_cuda=1920:1080:-1:-1:black"
+# Older ffmpeg has no pad_cuda, pad the already downscaled frame on the CPU
+CUDA_SCALE_CPU_PAD_FILTER = ("scale_cuda=1920:1080:force_original_aspect_ratio=decrease,"
+                             "hwdownload,format=nv12,pad=1920:1080:-1:-1:black,hwupload_cuda")
+CUDA_SCALE_FILTER = "scale_cuda=1920:1080"
+# vpp_qsv has no aspect ratio option, the fitted size is filled in per video
+QSV_SCALE_PAD_FILTER = "vpp_qsv=w={width}:h={height},hwdownload,format=nv12,pad=1920:1080:-1:-1:black"
+QSV_SCALE_FILTER = "vpp_qsv=w=1920:h=1080"
+
+# NVDEC decoders forced for NVENC conversions
+CUVID_DECODERS = {
+    'h264': 'h264_cuvid',
+    'hevc': 'hevc_cuvid',
+}
+
+# Encoder settings, quality 23 everywhere (similar to CRF 23) with the fastest presets
+NVENC_OPTIONS = (
+    '-preset', 'p1',  # Fastest preset for NVENC
+    '-tune', 'hq',  # High quality tune
+    '-rc', 'vbr',  # Variable bitrate
+    '-cq', '23',  # Quality setting (similar to CRF)
+)
+AMF_OPTIONS = (
+    '-usage', 'transcoding',
+    '-rc', 'cqp',
+    '-qp_i', '23',
+    '-qp_p', '23',
+)
+QSV_OPTIONS = (
+    '-preset', 'veryfast',
+    '-global_quality', '23',
+)
+LIBX264_OPTIONS = (  # CPU fallback
+    '-preset', 'ultrafast',
+    '-crf', '23',
+)
+ENCODER_OPTIONS = {
+    'h264_nvenc': NVENC_OPTIONS,
+    'h264_amf': AMF_OPTIONS,
+    'h264_qsv': QSV_OPTIONS,
+    'libx264': LIBX264_OPTIONS,
+}
+
+# Long videos get slower GPU presets with lookahead/pre-analysis: noticeably smaller files
+# for little extra time, while short clips keep the fastest presets (init time dominates)
+LONG_VIDEO_SECONDS = 600
+NVENC_LONG_VIDEO_OPTIONS = (
+    '-preset', 'p4',
+    '-tune', 'hq',
+    '-rc', 'vbr',
+    '-cq', '23',
+    '-rc-lookahead', '20',
+    '-spatial-aq', '1',
+    '-aq-strength', '8',
+)
+AMF_LONG_VIDEO_OPTIONS = AMF_OPTIONS + (
+    '-quality', 'quality',
+    '-preanalysis', 'true',
+)
+LONG_VIDEO_ENCODER_OPTIONS = {
+    'h264_nvenc': NVENC_LONG_VIDEO_OPTIONS,
+    'h264_amf': AMF_LONG_VIDEO_OPTIONS,
+}
+
+# Audio codecs that are copied as is; others (PCM, Opus, ...) can fail or be unplayable in MP4
+COPY_AUDIO_CODECS = ('aac', 'mp3')
+AUDIO_COPY_OPTIONS = ('-c:a', 'copy')
+AUDIO_AAC_OPTIONS = ('-c:a', 'aac', '-b:a', '192k')
+
+# Fragmented MP4 for --faststart: the moov atom is written up front while encoding, unlike
+# -movflags +faststart which rewrites the whole file in a second pass after the encode
+FASTSTART_OPTIONS = ('-movflags', 'frag_keyframe+empty_moov+default_base_moof')
+
+# One video to convert, as collected by convert_all_mp4s
+ConversionJob = namedtuple('ConversionJob',
+                           'input_path output_path width height duration video_codec audio_codec rotation')
 
 def get_video_info(video_path):
     """Get video information using ffprobe"""
     try:
         cmd = [
-            'ffprobe', 
-            '-v', 'quiet',
-            '-print_format', 'json',
-            '-show_format',
-            '-show_streams',
+            FFPROBE,
+            '-v', 'error',
+            '-show_entries', ('stream=codec_type,codec_name,width,height:stream_side_data=rotation:'
+                              'stream_tags=rotate:format=duration'),
+            '-of', 'json',
             video_path
         ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        # Parse output for width and height
-        width_match = re.search(r'"width":\s*(\d+)', result.stdout)
-        height_match = re.search(r'"height":\s*(\d+)', result.stdout)
-        duration_match = re.search(r'"duration":\s*"([^"]+)"', result.stdout)
+        result = subprocess.run(cmd, capture_output=True, text=True, **SPAWN_OPTIONS)
         
-        if width_match and height_match:
-            width = int(width_match.group(1))
-            height = int(height_match.group(1))
-            duration = float(duration_match.group(1)) if duration_match else 0
-            return width, height, duration
-        return None, None, 0
+        data = json.loads(result.stdout)
+        streams = data.get('streams', [])
+        # First video and audio stream, the ones convert_video maps
+        video = next((stream for stream in streams if stream.get('codec_type') == 'video'), None)
+        audio = next((stream for stream in streams if stream.get('codec_type') == 'audio'), None)
+        if video and 'width' in video and 'height' in video:
+            width = int(video['width'])
+            height = int(video['height'])
+            duration = float(data.get('format', {}).get('duration', 0))
+            audio_codec = audio.get('codec_name') if audio else None
+            
+            # Display rotation (display matrix, or the rotate tag of older files); ffmpeg
+            # autorotates while decoding, so report the size as displayed
+            rotation = video.get('tags', {}).get('rotate', 0)
+            for side_data in video.get('side_data_list', []):
+                rotation = side_data.get('rotation', rotation)
+            rotation = int(float(rotation)) % 360
+            if rotation in (90, 270):
+                width, height = height, width
+            return width, height, duration, video.get('codec_name'), audio_codec, rotation
+        return None, None, 0, None, None, 0
     except Exception as e:
         print(f"Error getting video info: {e}")
-        return None, None, 0
+        return None, None, 0, None, None, 0
+
+def get_gpu_ids():
+    """Get a description of the installed GPUs (changes when the hardware or driver changes)"""
+    if sys.platform == "win32":
+        cmd = [shutil.which('wmic') or 'wmic', 'path', 'win32_VideoController', 'get', 'name,pnpdeviceid,driverversion']
+    else:
+        # `nvidia-smi -L` leaves out the driver version
+        cmd = [shutil.which('nvidia-smi') or 'nvidia-smi', '--query-gpu=name,pci.bus_id,driver_version',
+               '--format=csv,noheader']
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=5, **SPAWN_OPTIONS)
+        gpu_ids = result.stdout.strip()
+    except (subprocess.TimeoutExpired, FileNotFoundError):
+        gpu_ids = ""
+    
+    # PCI vendor/device ids of all GPUs on Linux (covers AMD and Intel too), their drivers
+    # ship with the kernel
+    if sys.platform.startswith('linux'):
+        gpu_ids += f"\n{os.uname().release}"
+    for device in sorted(Path('/sys/class/drm').glob('card*/device')):
+        try:
+            gpu_ids += f"\n{(device / 'vendor').read_text().strip()}:{(device / 'device').read_text().strip()}"
+        except OSError:
+            continue
+    return gpu_ids
+
+def get_encoder_cache_key():
+    """Get the key the detected encoder is cached under (ffmpeg version + GPUs)"""
+    try:
+        result = subprocess.run([FFMPEG, '-version'], capture_output=True, text=True, **SPAWN_OPTIONS)
+        ffmpeg_version = result.stdout.split('\n', 1)[0]
+    except FileNotFoundError:
+        ffmpeg_version = ""
+    return hashlib.sha1((ffmpeg_version + get_gpu_ids()).encode()).hexdigest()
 
 def detect_gpu_encoder():
-    """Detect available GPU encoder"""
+    """Detect available GPU encoder (cached on disk per ffmpeg version and GPU)"""
     encoders = [
         ('h264_nvenc', 'NVIDIA NVENC'),
         ('h264_amf', 'AMD AMF'),
@@ -41,13 +186,44 @@ def detect_gpu_encoder():
         ('libx264', 'CPU (fallback)')
     ]
     
+    # Reuse the result of an earlier run on this machine, only hardware encoders are cached
+    # so a missing driver is detected again once it is installed
+    cache_key = get_encoder_cache_key()
+    try:
+        with open(ENCODER_CACHE_FILE, encoding='utf-8') as f:
+            cache = json.load(f)
+        names = dict(encoders[:-1])
+        if cache.get('key') == cache_key and cache.get('encoder') in names:
+            encoder = cache['encoder']
+            print(f"✅ Using encoder: {names[encoder]} ({encoder}, cached)")
+            return encoder
+    except (OSError, ValueError, AttributeError):
+        pass
+    
+    # One cheap listing tells which encoders this ffmpeg build has at all
+    available = get_ffmpeg_capabilities('-encoders')
+    
     for encoder, name in encoders:
+        if encoder not in available:
+            continue
         try:
-            cmd = ['ffmpeg', '-hide_banner', '-f', 'lavfi', '-i', 'testsrc=duration=1:size=320x240:rate=1', 
-                   '-c:v', encoder, '-f', 'null', '-']
-            result = subprocess.run(cmd, capture_output=True, timeout=5)
-            if result.returncode == 0:
+            if encoder == 'libx264':
+                returncode = 0  # Software encoder, nothing else to check
+            else:
+                # Builds often include hardware encoders without the hardware, so test encode
+                cmd = [FFMPEG, '-hide_banner', '-f', 'lavfi', '-i', 'testsrc=duration=1:size=320x240:rate=1', 
+                       '-c:v', encoder, '-f', 'null', '-']
+                returncode = subprocess.run(cmd, capture_output=True, timeout=5, **SPAWN_OPTIONS).returncode
+            if returncode == 0:
                 print(f"✅ Using encoder: {name} ({encoder})")
+                if encoder == 'libx264':
+                    return encoder
+                try:
+                    ENCODER_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+                    with open(ENCODER_CACHE_FILE, 'w', encoding='utf-8') as f:
+                        json.dump({'key': cache_key, 'encoder': encoder}, f)
+                except OSError as e:
+                    print(f"⚠️  Could not cache encoder: {e}")
                 return encoder
         except (subprocess.TimeoutExpired, subprocess.CalledProcessError, FileNotFoundError):
             continue
@@ -55,91 +231,318 @@ def detect_gpu_encoder():
     print("⚠️  No GPU encoder found, using CPU")
     return 'libx264'
 
-def convert_video(input_path, output_path, original_width, original_height, gpu_encoder):
-    """Convert video to 1920x1080 with black bars if needed"""
+@functools.lru_cache(maxsize=None)
+def get_ffmpeg_capabilities(option):
+    """Get the names listed by ffmpeg -filters, -encoders or -decoders (probed once per run)"""
+    try:
+        result = subprocess.run([FFMPEG, '-hide_banner', option], capture_output=True, text=True, **SPAWN_OPTIONS)
+        return frozenset(re.findall(r'^\s*[A-Z.]{3,6}\s+(\w+)\s', result.stdout, re.M))
+    except FileNotFoundError:
+        return frozenset()
+
+def fit_size(width, height):
+    """Get the largest even size that fits inside 1920x1080 keeping the aspect ratio"""
+    scale = min(1920 / width, 1080 / height)
+    return max(2, int(width * scale) // 2 * 2), max(2, int(height * scale) // 2 * 2)
+
+def convert_video(input_path, output_path, original_width, original_height, gpu_encoder, input_index=0,
+                  video_codec=None, duration=0, audio_codec=None, gpu_pipeline=True, rotation=0):
+    """Get the ffmpeg input and output arguments converting one video to 1920x1080 with black bars if needed
+    
+    The width and height are the displayed size (after rotation). With gpu_pipeline=False
+    decoding and scaling run on the CPU, only the encoder is used as is.
+    """
+    
+    # Don't re-encode audio unless MP4 can't take it as is (no audio stream: nothing to encode)
+    if audio_codec is None or audio_codec in COPY_AUDIO_CODECS:
+        audio_options = AUDIO_COPY_OPTIONS
+    else:
+        audio_options = AUDIO_AAC_OPTIONS
+    
+    # Already 1920x1080 H.264 - only remux the video, no decoding or encoding at all
+    if original_width == 1920 and original_height == 1080 and video_codec == 'h264':
+        input_args = ['-i', input_path]
+        cmd = [
+            '-map', f'{input_index}:v:0',
+            '-map', f'{input_index}:a:0?',
+            '-c:v', 'copy',
+            *audio_options,
+            output_path
+        ]
+        return input_args, cmd
     
     # Determine if we need padding
     aspect_ratio = original_width / original_height
     target_aspect = 1920 / 1080
+    needs_padding = abs(aspect_ratio - target_aspect) >= 1e-3
+    
+    # Centered padding adds the black bars top/bottom or left/right as needed
+    scale_filter = SCALE_PAD_FILTER if needs_padding else SCALE_FILTER
+    
+    # ffmpeg only autorotates software frames, rotated videos have to be scaled on the CPU
+    if rotation:
+        gpu_pipeline = False
+    
+    # Keep decoded frames in GPU memory when the encoder family supports it
+    hwaccel_args = []
+    filters = get_ffmpeg_capabilities('-filters') if gpu_pipeline else frozenset()
+    if 'nvenc' in gpu_encoder and 'scale_cuda' in filters:
+        # NVIDIA: NVDEC decode -> CUDA scale -> NVENC, no PCIe round-trip
+        hwaccel_args = ['-hwaccel', 'cuda', '-hwaccel_output_format', 'cuda']
+        # Force the NVDEC decoder for H.264/HEVC when ffmpeg has it (cuvid has no software fallback)
+        if video_codec in CUVID_DECODERS and CUVID_DECODERS[video_codec] in get_ffmpeg_capabilities('-decoders'):
+            hwaccel_args += ['-c:v', CUVID_DECODERS[video_codec]]
+        if not needs_padding:
+            scale_filter = CUDA_SCALE_FILTER
+        elif 'pad_cuda' in filters:
+            scale_filter = CUDA_SCALE_PAD_FILTER
+        else:
+            scale_filter = CUDA_SCALE_CPU_PAD_FILTER
+    elif 'qsv' in gpu_encoder and 'vpp_qsv' in filters:
+        # Intel: QSV decode -> vpp_qsv scale -> QuickSync
+        hwaccel_args = ['-hwaccel', 'qsv', '-hwaccel_output_format', 'qsv']
+        if not needs_padding:
+            scale_filter = QSV_SCALE_FILTER
+        else:
+            fit_width, fit_height = fit_size(original_width, original_height)
+            scale_filter = QSV_SCALE_PAD_FILTER.format(width=fit_width, height=fit_height)
+    elif 'amf' in gpu_encoder and sys.platform == "win32" and gpu_pipeline:
+        # AMD: decode on the GPU, frames are downloaded for the CPU scale/pad filters
+        hwaccel_args = ['-hwaccel', 'd3d11va']
     
-    if aspect_ratio > target_aspect:
-        # Video is wider - add black bars top and bottom
-        scale_filter = "scale=1920:1080:force_original_aspect_ratio=decrease,pad=1920:1080:-1:-1:black"
+    if duration > LONG_VIDEO_SECONDS and gpu_encoder in LONG_VIDEO_ENCODER_OPTIONS:
+        encoder_options = LONG_VIDEO_ENCODER_OPTIONS[gpu_encoder]
     else:
-        # Video is taller or correct ratio - add black bars left and right
-        scale_filter = "scale=1920:1080:force_original_aspect_ratio=decrease,pad=1920:1080:-1:-1:black"
+        encoder_options = ENCODER_OPTIONS.get(gpu_encoder, LIBX264_OPTIONS)
     
+    input_args = [*hwaccel_args, '-i', input_path]
     cmd = [
-        'ffmpeg',
-        '-i', input_path,
+        '-map', f'{input_index}:v:0',
+        '-map', f'{input_index}:a:0?',
         '-vf', scale_filter,
         '-c:v', gpu_encoder,
-        '-c:a', 'copy',  # Don't re-encode audio
-        '-y',  # Overwrite output file
-        '-stats',  # Show statistics during encoding
+        *encoder_options,  # GPU-specific settings
+        *audio_options,
         output_path
     ]
     
-    # GPU-specific settings
-    if 'nvenc' in gpu_encoder:
-        # NVIDIA NVENC settings
-        cmd.insert(-3, '-preset')
-        cmd.insert(-3, 'p1')  # Fastest preset for NVENC
-        cmd.insert(-3, '-tune')
-        cmd.insert(-3, 'hq')  # High quality tune
-        cmd.insert(-3, '-rc')
-        cmd.insert(-3, 'vbr')  # Variable bitrate
-        cmd.insert(-3, '-cq')
-        cmd.insert(-3, '23')  # Quality setting (similar to CRF)
-    elif 'amf' in gpu_encoder:
-        # AMD AMF settings
-        cmd.insert(-3, '-usage')
-        cmd.insert(-3, 'transcoding')
-        cmd.insert(-3, '-rc')
-        cmd.insert(-3, 'cqp')
-        cmd.insert(-3, '-qp_i')
-        cmd.insert(-3, '23')
-        cmd.insert(-3, '-qp_p')
-        cmd.insert(-3, '23')
-    elif 'qsv' in gpu_encoder:
-        # Intel QuickSync settings
-        cmd.insert(-3, '-preset')
-        cmd.insert(-3, 'veryfast')
-        cmd.insert(-3, '-global_quality')
-        cmd.insert(-3, '23')
-    else:
-        # CPU fallback
-        cmd.insert(-3, '-preset')
-        cmd.insert(-3, 'ultrafast')
-        cmd.insert(-3, '-crf')
-        cmd.insert(-3, '23')
+    return input_args, cmd
+
+def build_batch_command(jobs, gpu_encoder, threads=None, faststart=False, gpu_pipeline=True):
+    """Build a single ffmpeg command converting several videos (one input and output per job)
     
-    return cmd
+    `threads` is the number of CPU threads for the whole process, shared by its outputs.
+    """
+    cmd = [
+        FFMPEG,
+        '-hide_banner',
+        '-y',  # Overwrite output files
+        '-nostats',
+        '-progress', 'pipe:1',  # Machine readable progress on stdout
+    ]
+    output_args = []
+    for index, job in enumerate(jobs):
+        job_input_args, job_output_args = convert_video(job.input_path, job.output_path, job.width, job.height,
+                                                        gpu_encoder, index, job.video_codec, job.duration,
+                                                        job.audio_codec, gpu_pipeline, job.rotation)
+        cmd.extend(job_input_args)
+        if threads:
+            # Encoder threads for this output
+            output_args.extend(['-threads', str(max(1, threads // len(jobs)))])
+        if faststart:
+            output_args.extend(FASTSTART_OPTIONS)
+        output_args.extend(job_output_args)
+    return cmd + output_args
 
-def parse_progress(line, duration):
-    """Parse ffmpeg progress output"""
-    if 'out_time_us=' in line:
+def remove_partial_outputs(jobs):
+    """Remove unfinished output files so they are not skipped on the next run"""
+    for job in jobs:
         try:
-            time_us = int(line.split('=')[1].strip())
-            time_seconds = time_us / 1000000
-            if duration > 0:
-                percentage = (time_seconds / duration) * 100
-                return time_seconds, percentage
-        except (ValueError, IndexError):
+            os.remove(job.output_path)
+        except FileNotFoundError:
             pass
-    elif 'fps=' in line:
+
+class ProgressLine:
+    """A console line showing the progress of every running ffmpeg process"""
+    
+    def __init__(self):
+        self.running = {}  # label -> (percentage, fps)
+        self.width = 0
+        self.last_draw = 0
+    
+    def update(self, label, percentage, fps):
+        """Update the progress of one process, redrawn at most every PROGRESS_INTERVAL seconds"""
+        self.running[label] = (percentage, fps)
+        now = time.monotonic()
+        if now - self.last_draw >= PROGRESS_INTERVAL or percentage >= 100:
+            self.last_draw = now
+            self.draw()
+    
+    def remove(self, label):
+        """Stop showing a finished process"""
+        self.running.pop(label, None)
+    
+    def draw(self):
+        line = "🔄 " + " | ".join(PROGRESS_TEMPLATE.format(label, percentage, fps)
+                                  for label, (percentage, fps) in self.running.items())
+        sys.stdout.write("\r" + line.ljust(self.width))
+        sys.stdout.flush()
+        self.width = len(line) + 1  # The emoji takes two columns
+    
+    def print(self, message):
+        """Print a message on its own line(s), keeping the progress line below it"""
+        if self.width:
+            sys.stdout.write("\r" + " " * self.width + "\r")
+            self.width = 0
+        print(message)
+        if self.running:
+            self.draw()
+
+async def run_ffmpeg(cmd, jobs, label, progress, cpu_set=None):
+    """Run one ffmpeg process and show its progress, returns the exit code and its last messages"""
+    # Progress follows the longest video of the process
+    duration = max(job.duration for job in jobs)
+    
+    # Pin the process to its own CPU cores while it runs
+    if cpu_set:
+        cmd = ['taskset', '-c', cpu_set] + cmd
+    
+    process = None
+    try:
+        progress.print("🔄 Starting conversion...")
+        
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT  # Redirect stderr to stdout
+        )
+        
+        current_fps = 0
+        log_lines = deque(maxlen=10)  # Last ffmpeg messages, shown on errors
+        
+        # -progress writes blocks of key=value lines, ending with progress=continue/end
+        async for line in process.stdout:
+            line = line.decode(errors='replace').strip()
+            key, separator, value = line.partition('=')
+            if not separator or ' ' in key:
+                if line:
+                    log_lines.append(line)
+            elif key == 'out_time_us':
+                try:
+                    time_seconds = int(value) / 1000000
+                except ValueError:
+                    continue  # N/A before the first frame
+                if duration > 0:
+                    progress.update(label, (time_seconds / duration) * 100, current_fps)
+            elif key == 'fps':
+                try:
+                    current_fps = float(value)
+                except ValueError:
+                    pass
+            elif key == 'progress' and value == 'end':
+                break
+        
+        # Wait for process to finish
+        return_code = await process.wait()
+        progress.remove(label)
+        if return_code != 0:
+            # Keep the last ffmpeg messages for error info
+            try:
+                log_lines.extend((await process.stdout.read()).decode(errors='replace').splitlines())
+            except (OSError, ValueError):
+                pass
+        return return_code, log_lines
+            
+    except asyncio.CancelledError:
+        # Interrupted by the user
+        progress.remove(label)
         try:
-            fps_str = line.split('=')[1].strip()
-            # Remove extra text like ' fps'
-            fps_str = fps_str.replace(' fps', '').strip()
-            fps = float(fps_str)
-            return None, fps
-        except (ValueError, IndexError):
-            pass
-    return None, None
+            if process is not None and process.returncode is None:
+                process.terminate()
+                # Another cancellation must not skip the cleanup below
+                await asyncio.shield(process.wait())
+        except ProcessLookupError:
+            pass  # Already exited
+        finally:
+            remove_partial_outputs(jobs)
+        raise
 
-def convert_all_mp4s(input_directory=".", output_directory=None):
-    """Convert all MP4 files in a directory"""
+def report_result(jobs, return_code, log_lines, progress):
+    """Print the outcome of an ffmpeg run, removing its outputs if it failed"""
+    filenames = [os.path.basename(job.input_path) for job in jobs]
+    if return_code == 0:
+        for filename in filenames:
+            progress.print(f"✅ Completed: {filename} -> converted_{filename}")
+        return
+    
+    message = f"❌ Error converting {', '.join(filenames)}\nReturn code: {return_code}"
+    if log_lines:
+        message += "\nLast output:\n" + "\n".join(log_lines)
+    progress.print(message)
+    remove_partial_outputs(jobs)
+
+async def convert_single(job, label, build_command, progress, cpu_set):
+    """Convert one video, retrying with CPU decoding/scaling if the GPU pipeline fails"""
+    cmd = build_command([job])
+    return_code, log_lines = await run_ffmpeg(cmd, [job], label, progress, cpu_set)
+    
+    cpu_cmd = build_command([job], gpu_pipeline=False)
+    if return_code != 0 and cpu_cmd != cmd:
+        # E.g. a codec or profile the GPU decoder does not support
+        remove_partial_outputs([job])
+        progress.print(f"\n⚠️  GPU pipeline failed (return code {return_code}), retrying with CPU decoding and scaling")
+        return_code, log_lines = await run_ffmpeg(cpu_cmd, [job], label, progress, cpu_set)
+    
+    report_result([job], return_code, log_lines, progress)
+
+async def run_batch(batch, label, build_command, progress, cpu_sets):
+    """Convert a batch of videos with one ffmpeg process, retrying them one by one if it fails"""
+    filenames = [os.path.basename(job.input_path) for job in batch]
+    cpu_set = cpu_sets.pop() if cpu_sets else None
+    try:
+        progress.print(f"\n{label} {', '.join(filenames)}")
+        if len(batch) == 1:
+            await convert_single(batch[0], label, build_command, progress, cpu_set)
+            return
+        
+        return_code, log_lines = await run_ffmpeg(build_command(batch), batch, label, progress, cpu_set)
+        if return_code == 0:
+            report_result(batch, return_code, log_lines, progress)
+            return
+        
+        # One bad input fails the whole process, convert the files separately so only it fails
+        remove_partial_outputs(batch)
+        progress.print(f"\n⚠️  {label} failed (return code {return_code}), converting its files one by one")
+        for job in batch:
+            progress.print(f"\n{label} {os.path.basename(job.input_path)}")
+            await convert_single(job, label, build_command, progress, cpu_set)
+    except Exception as e:
+        progress.print(f"\n❌ Unexpected error with {', '.join(filenames)}: {e}")
+        remove_partial_outputs(batch)
+    finally:
+        if cpu_set:
+            cpu_sets.append(cpu_set)
+
+async def run_batches(batches, build_command, parallel, cpu_sets):
+    """Convert the batches, keeping up to `parallel` ffmpeg processes in flight"""
+    semaphore = asyncio.Semaphore(parallel)
+    progress = ProgressLine()
+    
+    async def run_bounded(batch, label):
+        async with semaphore:
+            await run_batch(batch, label, build_command, progress, cpu_sets)
+    
+    # Wait for every batch, also when cancelled, so each one removes its partial outputs
+    results = await asyncio.gather(*(
+        run_bounded(batch, f"[Batch {batch_number}/{len(batches)}]")
+        for batch_number, batch in enumerate(batches, 1)
+    ), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+def convert_all_mp4s(input_directory=".", output_directory=None, parallel=None, faststart=False):
+    """Convert all MP4 files in a directory, running up to `parallel` ffmpeg processes at once"""
     
     if output_directory is None:
         output_directory = os.path.join(input_directory, "converted")
@@ -150,165 +553,105 @@ def convert_all_mp4s(input_directory=".", output_directory=None):
     # Detect best GPU encoder
     gpu_encoder = detect_gpu_encoder()
     
-    # Find all MP4 files (prevent duplicates on Windows)
-    mp4_files = []
-    for pattern in ["*.mp4", "*.MP4"]:
-        found_files = glob.glob(os.path.join(input_directory, pattern))
-        for file in found_files:
-            # Normalize path to prevent duplicates on case-insensitive filesystems
-            normalized_path = os.path.normcase(file)
-            if not any(os.path.normcase(existing) == normalized_path for existing in mp4_files):
-                mp4_files.append(file)
-    
-    if not mp4_files:
+    # Find all MP4 files (case-insensitive extension, prevent duplicates on Windows)
+    mp4_entries = []
+    seen_paths = set()
+    with os.scandir(input_directory) as entries:
+        for entry in entries:
+            # Hidden files are skipped like glob does (e.g. macOS '._' metadata files)
+            if entry.name.lower().endswith('.mp4') and not entry.name.startswith('.') and entry.is_file():
+                # Normalize path to prevent duplicates on case-insensitive filesystems
+                normalized_path = os.path.normcase(entry.path)
+                if normalized_path not in seen_paths:
+                    seen_paths.add(normalized_path)
+                    mp4_entries.append(entry)
+    
+    if not mp4_entries:
         print("No MP4 files found in the specified directory.")
         return
     
-    print(f"Found {len(mp4_files)} MP4 file(s)")
+    print(f"Found {len(mp4_entries)} MP4 file(s)")
     print(f"Output directory: {output_directory}")
     print("-" * 50)
     
-    for i, input_file in enumerate(mp4_files, 1):
-        filename = os.path.basename(input_file)
-        output_file = os.path.join(output_directory, f"converted_{filename}")
+    # Get video information for all files that still need converting, in parallel
+    # (each ffprobe call mostly waits on process startup and disk I/O)
+    candidates = []
+    with ThreadPoolExecutor(max_workers=min(16, len(mp4_entries))) as executor:
+        for entry in mp4_entries:
+            output_file = os.path.join(output_directory, f"converted_{entry.name}")
+            probe = None
+            if os.path.lexists(output_file):
+                skip_message = f"❌ Output file already exists: {output_file}"
+            elif entry.stat().st_size == 0:  # Cached by scandir (no extra syscall on Windows)
+                skip_message = "❌ File is empty, skipping"
+            else:
+                skip_message = None
+                probe = executor.submit(get_video_info, entry.path)
+            candidates.append((entry, output_file, probe, skip_message))
+    
+    # Collect the videos that need converting
+    jobs = []
+    for i, (entry, output_file, probe, skip_message) in enumerate(candidates, 1):
+        filename = entry.name
         
-        print(f"\n[{i}/{len(mp4_files)}] Processing: {filename}")
+        print(f"\n[{i}/{len(candidates)}] Processing: {filename}")
         
-        # Check if output file already exists
-        if os.path.exists(output_file):
-            print(f"❌ Output file already exists: {output_file}")
+        # Check if output file already exists or the input is empty (e.g. an unfinished copy)
+        if skip_message:
+            print(skip_message)
             continue
         
         # Get video information
-        width, height, duration = get_video_info(input_file)
+        width, height, duration, video_codec, audio_codec, rotation = probe.result()
         if width is None or height is None:
             print(f"❌ Could not get video information for {filename}")
             continue
             
-        print(f"📹 Original resolution: {width}x{height}")
+        print(f"📹 Original resolution: {width}x{height}" + (f" (rotated {rotation}°)" if rotation else ""))
         print(f"⏱️  Duration: {duration:.1f} seconds")
         
-        # If already 1920x1080, skip
+        # If already 1920x1080, copy H.264 as is and skip other codecs
         if width == 1920 and height == 1080:
-            print(f"✅ Video already has correct resolution, skipping")
-            continue
-        
-        # Start conversion with GPU encoder
-        cmd = convert_video(input_file, output_file, width, height, gpu_encoder)
+            if video_codec != 'h264':
+                print(f"✅ Video already has correct resolution, skipping")
+                continue
+            print(f"✅ Video already has correct resolution, copying without re-encoding")
         
-        try:
-            print("🔄 Starting conversion...")
-            
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,  # Redirect stderr to stdout
-                universal_newlines=True,
-                bufsize=1
-            )
-            
-            current_fps = 0
-            last_percentage = 0
-            
-            # Read progress output with timeout
-            import select
-            import sys
-            
-            while True:
-                # Check if process is still running
-                if process.poll() is not None:
-                    break
-                
-                # Try to read output (non-blocking on Unix, simplified on Windows)
-                if sys.platform == "win32":
-                    # Windows - simpler approach
-                    try:
-                        line = process.stdout.readline()
-                        if not line:
-                            break
-                        
-                        line = line.strip()
-                        if not line:
-                            continue
-                            
-                        # Parse progress
-                        time_info, percentage_or_fps = parse_progress(line, duration)
-                        
-                        if time_info is not None:  # This is time progress
-                            percentage = percentage_or_fps
-                            if percentage > last_percentage + 1:  # Update every 1%
-                                print(f"\r🔄 Progress: {percentage:.1f}% - {current_fps:.1f} fps", end='', flush=True)
-                                last_percentage = percentage
-                                
-                        elif percentage_or_fps is not None:  # This is fps info
-                            current_fps = percentage_or_fps
-                            
-                        # Show general ffmpeg output for debugging
-                        if 'frame=' in line or 'time=' in line:
-                            # Extract frame and time info from standard ffmpeg output
-                            frame_match = re.search(r'frame=\s*(\d+)', line)
-                            time_match = re.search(r'time=(\d{2}):(\d{2}):(\d{2}.\d{2})', line)
-                            fps_match = re.search(r'fps=\s*([\d.]+)', line)
-                            
-                            if time_match and duration > 0:
-                                hours, minutes, seconds = time_match.groups()
-                                current_time = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
-                                percentage = (current_time / duration) * 100
-                                
-                                if fps_match:
-                                    try:
-                                        current_fps = float(fps_match.group(1))
-                                    except ValueError:
-                                        pass  # Ignore invalid fps values
-                                
-                                if percentage > last_percentage + 1 or (percentage - last_percentage) > 5:
-                                    print(f"\r🔄 Progress: {percentage:.1f}% - {current_fps:.1f} fps", end='', flush=True)
-                                    last_percentage = percentage
-                                    
-                    except Exception as e:
-                        print(f"\nError reading output: {e}")
-                        break
-                else:
-                    # Unix-based systems
-                    ready, _, _ = select.select([process.stdout], [], [], 0.1)
-                    if ready:
-                        line = process.stdout.readline()
-                        if not line:
-                            break
-                        # Same parsing logic as Windows
-                        line = line.strip()
-                        time_info, percentage_or_fps = parse_progress(line, duration)
-                        
-                        if time_info is not None:
-                            percentage = percentage_or_fps
-                            if percentage > last_percentage + 1:
-                                print(f"\r🔄 Progress: {percentage:.1f}% - {current_fps:.1f} fps", end='', flush=True)
-                                last_percentage = percentage
-                        elif percentage_or_fps is not None:
-                            current_fps = percentage_or_fps
-            
-            # Wait for process to finish
-            return_code = process.wait()
-            
-            if return_code == 0:
-                print(f"\r✅ Completed: {filename} -> converted_{filename}                    ")
-            else:
-                print(f"\r❌ Error converting {filename}")
-                print(f"Return code: {return_code}")
-                # Try to read last output for error info
-                try:
-                    remaining_output = process.stdout.read()
-                    if remaining_output:
-                        print(f"Last output: {remaining_output[-200:]}")  # Last 200 chars
-                except:
-                    pass
-                
-        except KeyboardInterrupt:
-            print(f"\n⚠️  Conversion interrupted by user")
-            process.terminate()
-            break
-        except Exception as e:
-            print(f"\r❌ Unexpected error with {filename}: {e}")
+        jobs.append(ConversionJob(entry.path, output_file, width, height, duration, video_codec, audio_codec,
+                                  rotation))
+    
+    if 'nvenc' in gpu_encoder:
+        # Let the NVENC sessions of a batch submit work to the GPU side by side
+        os.environ.setdefault('CUDA_DEVICE_MAX_CONNECTIONS', '2')
+    
+    if parallel is None:
+        # Each process already runs BATCH_SIZE encodes, more would exceed the NVENC session
+        # limit of consumer GPUs, and libx264 already uses every core from a single process
+        parallel = 1
+    
+    # Split the CPU cores this process may run on (not necessarily 0..n-1 under taskset,
+    # cgroups or containers) between the parallel ffmpeg processes
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    threads_per_process = max(1, len(cpus) // parallel)
+    cpu_sets = None
+    if parallel > 1 and sys.platform.startswith('linux') and shutil.which('taskset'):
+        cpu_sets = []
+        for slot in range(parallel):
+            first = (slot * threads_per_process) % len(cpus)
+            cpu_sets.append(','.join(str(cpu) for cpu in cpus[first:first + threads_per_process]))
+    
+    # Convert in batches, one ffmpeg process per batch and up to `parallel` processes at once
+    batches = [jobs[i:i + BATCH_SIZE] for i in range(0, len(jobs), BATCH_SIZE)]
+    build_command = functools.partial(build_batch_command, gpu_encoder=gpu_encoder,
+                                      threads=threads_per_process, faststart=faststart)
+    try:
+        asyncio.run(run_batches(batches, build_command, parallel, cpu_sets))
+    except KeyboardInterrupt:
+        print(f"\n⚠️  Conversion interrupted by user")
     
     print(f"\n{'='*50}")
     print("🎬 All conversions completed!")
@@ -318,17 +661,31 @@ if __name__ == "__main__":
     INPUT_DIR = "."  # Current directory, change to desired directory
     OUTPUT_DIR = None  # None = create 'converted' subdirectory, or specify custom path
     
+    parser = argparse.ArgumentParser(description="Convert all MP4 files in a directory to 1920x1080")
+    parser.add_argument('input_dir', nargs='?', default=INPUT_DIR,
+                        help="directory with the MP4 files (default: %(default)s)")
+    parser.add_argument('-o', '--output-dir', default=OUTPUT_DIR,
+                        help="output directory (default: 'converted' inside the input directory)")
+    parser.add_argument('--parallel', type=int, default=None, metavar='N',
+                        help="run N ffmpeg processes (of up to %d videos each) at once, each with its own share "
+                             "of the CPU cores (default: 1)" % BATCH_SIZE)
+    parser.add_argument('--faststart', action='store_true',
+                        help="write fragmented MP4s that can start playing before fully downloaded")
+    args = parser.parse_args()
+    if args.parallel is not None and args.parallel < 1:
+        parser.error("--parallel must be at least 1")
+    
     print("🎬 MP4 to 1920x1080 Converter with GPU Acceleration")
     print("=" * 50)
     
     # Check if ffmpeg and ffprobe are available
     try:
-        subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
-        subprocess.run(['ffprobe', '-version'], capture_output=True, check=True)
+        subprocess.run([FFMPEG, '-version'], capture_output=True, check=True, **SPAWN_OPTIONS)
+        subprocess.run([FFPROBE, '-version'], capture_output=True, check=True, **SPAWN_OPTIONS)
     except (subprocess.CalledProcessError, FileNotFoundError):
         print("❌ FFmpeg and/or FFprobe not found!")
         print("Please install FFmpeg first: https://ffmpeg.org/download.html")
         exit(1)
     
     # Start conversion
-    convert_all_mp4s(INPUT_DIR, OUTPUT_DIR)
\ No newline at end of file
+    convert_all_mp4s(args.input_dir, args.output_dir, args.parallel, args.faststart)
\ No newline at end of file